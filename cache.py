@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# Semantic response cache shared by the Ollama demos
+#
+# - The question text is embedded with Ollama /api/embed (default: nomic-embed-text)
+#   and compared by cosine similarity against previously stored questions.
+# - Entries are grouped by a namespace (model + hash of the surrounding context), so a hit
+#   only happens when the data/conversation the answer depends on is byte-identical.
+# - Similarity above the threshold returns the stored response without calling the model.
+# - Persisted as a .npz file: embeddings [N, D], namespaces [N], responses [N].
+import hashlib
+import os
+
+import httpx
+import numpy as np
+
+EMBED_MODEL = "nomic-embed-text"
+THRESHOLD = 0.92
+
+def namespace(model, context):
+    return model + "\0" + hashlib.sha256(context.encode("utf-8")).hexdigest()
+
+class SemanticCache:
+    def __init__(self, client, path, embed_model=EMBED_MODEL, threshold=THRESHOLD):
+        self.client = client
+        self.path = path
+        self.embed_model = embed_model
+        self.threshold = threshold
+        self.enabled = bool(path)  # '' disables the cache
+        self.embeddings = None  # float32 [N, D], rows L2-normalized
+        self.namespaces = []
+        self.responses = []
+        if path and os.path.exists(path):
+            with np.load(path, allow_pickle=False) as z:
+                self.embeddings = z["embeddings"]
+                self.namespaces = z["namespaces"].tolist()
+                self.responses = z["responses"].tolist()
+
+    async def embed(self, text):
+        r = await self.client.post("/api/embed", json={"model": self.embed_model, "input": text, "keep_alive": "30m"})
+        r.raise_for_status()
+        v = np.asarray(r.json()["embeddings"][0], dtype=np.float32)
+        n = np.linalg.norm(v)
+        return v / n if n else v
+
+    # Returns (response or None, embedding); on a miss the embedding is passed back to add()
+    async def lookup(self, ns, text):
+        if not self.enabled:
+            return None, None
+        try:
+            emb = await self.embed(text)
+        except httpx.HTTPError as e:
+            # Embedding model missing or server error: run uncached instead of failing the call
+            print(f"[cache disabled] {e}")
+            self.enabled = False
+            return None, None
+        if self.responses and self.embeddings.shape[1] == emb.shape[0]:
+            sims = self.embeddings @ emb
+            sims[np.asarray(self.namespaces) != ns] = -1.0
+            i = int(sims.argmax())
+            if sims[i] > self.threshold:
+                return self.responses[i], emb
+        return None, emb
+
+    def add(self, ns, emb, response):
+        if emb is None:
+            return
+        if self.responses and self.embeddings.shape[1] == emb.shape[0]:
+            self.embeddings = np.vstack([self.embeddings, emb[None]])
+        else:
+            # First entry, or embedding model changed: start over
+            self.embeddings = emb[None]
+            self.namespaces, self.responses = [], []
+        self.namespaces.append(ns)
+        self.responses.append(response)
+
+    def save(self):
+        if not self.path or not self.responses:
+            return
+        with open(self.path, "wb") as f:
+            np.savez(f, embeddings=self.embeddings,
+                     namespaces=np.array(self.namespaces, dtype=str),
+                     responses=np.array(self.responses, dtype=str))
@@ -7,11 +7,36 @@
 #
 # 사용법:
 #   python llm_only_demo.py --file /path/to/data.xlsx --model llama3.2 --days 14 --question "지난주 일평균 대비 어제 매출은?"
+#   (--question 여러 개 → 동시 요청. 서버를 OLLAMA_NUM_PARALLEL=<질문 수> 로 띄워야 병렬 처리됩니다.)
+#   (--cache ollama_cache.npz: 같은 데이터에 대한 비슷한 질문은 의미 캐시로 응답. 기본은 꺼짐, ollama pull nomic-embed-text 필요)
 import argparse
+import asyncio
+import json
 import sys
-import subprocess
+from datetime import datetime
+import httpx
+import numpy as np
 import pandas as pd
+from importlib.util import find_spec
+try:
+    import polars as pl  # 있으면 CSV/Excel 읽기를 polars로 (pandas 대비 수 배 빠름)
+except ImportError:
+    pl = None
+POLARS_EXCEL = pl is not None and find_spec('fastexcel') is not None  # read_excel(calamine) 엔진
+try:
+    import pyarrow as pa  # 있으면 CSV 텍스트를 C++ 라이터로 생성
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = None
 from io import StringIO
+from cache import SemanticCache, namespace
+try:
+    from orjson import loads as _loads  # 스트리밍 NDJSON 줄 단위 디코딩을 orjson으로
+except ImportError:
+    _loads = json.loads
+
+OLLAMA_HOST = 'http://localhost:11434'
+client = httpx.AsyncClient(base_url=OLLAMA_HOST, timeout=None)
 
 def pick_column(cols, candidates):
     lower = {c.lower(): c for c in cols}
@@ -21,49 +46,160 @@ def pick_column(cols, candidates):
     # fallback
     return cols[0]
 
+# 날짜 형식 후보. '/' 구분은 pandas 기본 추론과 같게 월/일 우선
+DATE_FORMATS = ['%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y/%m/%d', '%m/%d/%Y', '%d/%m/%Y']
+
+def detect_date_format(sample):
+    for fmt in DATE_FORMATS:
+        try:
+            datetime.strptime(sample, fmt)
+            return fmt
+        except ValueError:
+            pass
+    return None
+
+def first_str(values):
+    # 첫 번째 non-null 값이 문자열이면 반환 (이미 날짜 타입이면 None)
+    for v in values:
+        if pd.notna(v):
+            return v if isinstance(v, str) else None
+    return None
+
 def load_table(path):
-    if path.lower().endswith(('.xlsx', '.xls')):
-        df = pd.read_excel(path)
+    is_excel = path.lower().endswith(('.xlsx', '.xls'))
+    use_pl = POLARS_EXCEL if is_excel else pl is not None
+    if use_pl:
+        # 스키마만 보고 컬럼을 고른 뒤 두 컬럼만 읽음. pandas 변환은 마지막에 한 번만
+        # infer_schema_length=None: 앞 100행만 보고 타입을 정하면 뒤쪽 값(예: 정수 뒤 12.5)에서 실패
+        if is_excel:
+            lf = pl.read_excel(path, infer_schema_length=None).lazy()
+        else:
+            lf = pl.scan_csv(path, infer_schema_length=None)
+        cols = lf.collect_schema().names()
     else:
-        df = pd.read_csv(path)
+        df = pd.read_excel(path) if is_excel else pd.read_csv(path)
+        cols = list(df.columns)
     # heuristic: find date and amount
-    date_col = pick_column(df.columns, ['date','날짜','일자','order_date','created_at'])
-    amount_col = pick_column(df.columns, ['amount','매출','매출액','sales','sales_amount','revenue'])
-    df = df[[date_col, amount_col]].copy()
+    date_col = pick_column(cols, ['date','날짜','일자','order_date','created_at'])
+    amount_col = pick_column(cols, ['amount','매출','매출액','sales','sales_amount','revenue'])
+    if use_pl:
+        # 별칭으로 선택: 두 후보가 모두 cols[0]로 떨어져 같은 컬럼이어도 중복 선택 오류 없음
+        pdf = lf.select([pl.col(date_col).alias('date'), pl.col(amount_col).alias('amount')]).collect()
+        sample = first_str(pdf['date'].drop_nulls().head(1)) if pdf['date'].dtype == pl.String else None
+        fmt = detect_date_format(sample) if sample is not None else None
+        if fmt:
+            pdf = pdf.with_columns(pl.col('date').str.to_datetime(format=fmt, strict=False))
+        df = pdf.to_pandas()
+    else:
+        df = df[[date_col, amount_col]].copy()
     df.columns = ['date','amount']
-    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    # 첫 값으로 형식을 정하면 값마다 형식을 추론하지 않는 빠른 파서를 탐. 실패 시에만 추론 경로
+    sample = first_str(df['date'].head(1000))
+    fmt = detect_date_format(sample) if sample is not None else None
+    if fmt:
+        df['date'] = pd.to_datetime(df['date'], format=fmt, errors='coerce', cache=True)
+    else:
+        df['date'] = pd.to_datetime(df['date'], errors='coerce')
     df = df.dropna(subset=['date'])
     return df
 
 def to_csv_text(df, days):
-    df = df.sort_values('date')
-    if not df.empty:
-        end = df['date'].max().normalize()
-        start = end - pd.Timedelta(days=days-1)
-        df = df[(df['date'] >= start) & (df['date'] <= end)]
-    tmp = df.copy()
-    tmp['date'] = tmp['date'].dt.strftime('%Y-%m-%d')
-    out = StringIO()
-    tmp.to_csv(out, index=False)
-    return out.getvalue()
-
-PROMPT_TMPL = '''SYSTEM:
+    df = df.sort_values('date', kind='mergesort')
+    # 정렬된 일(day) 단위 배열에서 시작 위치만 이분 탐색 → 마스크/복사/strftime 없이 슬라이스
+    day = df['date'].to_numpy().astype('datetime64[D]')
+    lo = 0
+    if len(day):
+        lo = np.searchsorted(day, day[-1] - np.timedelta64(days-1, 'D'), side='left')
+    # 토큰 절약용 압축 형식: 헤더 없음, YYYYMMDD, 금액은 1000 이상이면 천 단위 소수 1자리(12.3k)
+    # 1000 미만은 그대로(35.75; k로 쓰면 0.0k가 됨), 마지막 줄바꿈 없음
+    raw = df['amount'].iloc[lo:]
+    if pd.api.types.is_numeric_dtype(raw):
+        amount = raw.to_numpy(np.float64)
+        as_is = np.full(len(raw), '', dtype=object)
+    else:
+        # 텍스트 금액("1,000" 등): 숫자로 읽히면 k 형식, 아니면 원래 값을 그대로(구분자/따옴표만 제거)
+        text_vals = raw.astype(str).str.replace(r'[,"\r\n]', '', regex=True)
+        amount = pd.to_numeric(text_vals, errors='coerce').to_numpy(np.float64)
+        as_is = np.where(raw.isna().to_numpy(), '', text_vals.to_numpy(dtype=object))
+    scaled = np.where(np.abs(amount) >= 1000, np.char.mod('%.1fk', amount / 1000), np.char.mod('%g', amount))
+    cols = {
+        'date': np.char.replace(day[lo:].astype(str), '-', ''),
+        'amount': np.where(np.isnan(amount), as_is, scaled).astype(str),
+    }
+    if pa is not None:
+        # 값에 쉼표/따옴표가 없으므로 quoting 없이 그대로 씀
+        sink = pa.BufferOutputStream()
+        pacsv.write_csv(pa.table(cols), sink,
+                        write_options=pacsv.WriteOptions(include_header=False, quoting_style='none'))
+        text = sink.getvalue().to_pybytes().decode('utf-8')
+    else:
+        out = StringIO()
+        pd.DataFrame(cols).to_csv(out, index=False, header=False)
+        text = out.getvalue()
+    return text.rstrip('\n')
+
+# 프롬프트는 고정 조각 + 동적 조각(csv_text, question)의 이어붙이기 (매 호출 템플릿 파싱 없음)
+PROMPT_PREFIX = '''SYSTEM:
 너는 데이터 분석 LLM이야. 아래의 CSV만 보고 사용자의 질문에 답해.
 반드시 수치를 추론해서 한국어로 간단히 설명해. 불확실해도 추정해서 말해도 된다.
 
-CSV(최근 데이터 일부):
-{csv_text}
+CSV(최근 데이터 일부, 헤더 없음):
+형식: 한 줄에 한 건 "날짜(YYYYMMDD),매출". 매출이 k로 끝나면 천 단위, 아니면 그대로의 값. 예: 20250105,12.3k = 2025-01-05 매출 12,300 / 20250106,35.75 = 매출 35.75
+'''
+PROMPT_MIDDLE = '''
 
 USER 질문:
-{question}
 '''
+PROMPT_SUFFIX = '\n'
+
+def build_prompt(csv_text, question):
+    return ''.join((PROMPT_PREFIX, csv_text, PROMPT_MIDDLE, question, PROMPT_SUFFIX))
+
+def write_chunk(piece):
+    sys.stdout.write(piece)
+    sys.stdout.flush()
+
+async def run_ollama(model, prompt, on_chunk=None):
+    # ollama run 서브프로세스 대신 상주 서버 HTTP API 사용 (keep_alive 동안 모델 유지)
+    # stream=True: 토큰이 오는 대로 on_chunk로 넘기고, 전체 응답은 모아서 반환
+    parts = []
+    async with client.stream('POST', '/api/generate', json={
+        'model': model, 'prompt': prompt, 'stream': True, 'keep_alive': '30m',
+    }) as r:
+        if r.status_code != 200:
+            await r.aread()
+            r.raise_for_status()
+        async for line in r.aiter_lines():
+            if not line:
+                continue
+            chunk = _loads(line)
+            if 'error' in chunk:
+                raise RuntimeError(chunk['error'])
+            piece = chunk.get('response', '')
+            parts.append(piece)
+            if on_chunk is not None:
+                on_chunk(piece)
+    return ''.join(parts)
+
+async def run_ollama_cached(cache, ns, model, question, prompt, on_chunk=None):
+    # 질문 문장만 임베딩 (CSV는 ns 해시로 완전 일치 비교)
+    hit, emb = await cache.lookup(ns, question)
+    if hit is not None:
+        print(f'[semantic cache hit] {question}')
+        if on_chunk is not None:
+            on_chunk(hit)
+        return hit
+    reply = await run_ollama(model, prompt, on_chunk=on_chunk)
+    cache.add(ns, emb, reply)
+    return reply
 
-def main():
+async def main():
     ap = argparse.ArgumentParser()
     ap.add_argument('--file', required=True, help='Excel or CSV file path')
     ap.add_argument('--model', default='llama3.2')
     ap.add_argument('--days', type=int, default=14, help='recent N days to include')
-    ap.add_argument('--question', required=True)
+    ap.add_argument('--question', required=True, nargs='+')
+    ap.add_argument('--cache', default='', help='semantic cache file, e.g. ollama_cache.npz (default: off)')
     args = ap.parse_args()
 
     df = load_table(args.file)
@@ -72,17 +208,30 @@ def main():
         sys.exit(1)
     csv_text = to_csv_text(df, args.days)
 
-    prompt = PROMPT_TMPL.format(csv_text=csv_text, question=args.question)
+    cache = SemanticCache(client, args.cache)
+    ns = namespace(args.model, csv_text)
+    prompts = [build_prompt(csv_text, q) for q in args.question]
     print('=== LLM 요청 프롬프트(요약) ===')
-    print(prompt[:1000] + ('...\n' if len(prompt) > 1000 else '\n'))
-    print('=== 모델 응답 ===')
+    print(prompts[0][:1000] + ('...\n' if len(prompts[0]) > 1000 else '\n'))
+    # 질문이 하나면 바로 스트리밍 출력, 여러 개면 출력이 섞이지 않게 모아서 출력
+    stream = len(prompts) == 1
+    if stream:
+        print(f'=== 모델 응답: {args.question[0]} ===')
     try:
-        proc = subprocess.run(['ollama', 'run', args.model], input=prompt.encode('utf-8'),
-                              capture_output=True, check=True)
-        print(proc.stdout.decode('utf-8', errors='ignore'))
-    except subprocess.CalledProcessError as e:
-        print('Ollama 호출 오류:', e.stderr.decode('utf-8', errors='ignore'))
+        async with client:
+            replies = await asyncio.gather(*(run_ollama_cached(cache, ns, args.model, q, p,
+                                                               on_chunk=write_chunk if stream else None)
+                                             for q, p in zip(args.question, prompts)))
+    except (httpx.HTTPError, RuntimeError) as e:
+        print('Ollama 호출 오류:', e)
         sys.exit(2)
+    cache.save()
+    if stream:
+        print()
+        return
+    for q, reply in zip(args.question, replies):
+        print(f'=== 모델 응답: {q} ===')
+        print(reply)
 
 if __name__ == '__main__':
-    main()
+    asyncio.run(main())
@@ -7,12 +7,42 @@
 #
 # 사용법:
 #   python llm_plus_executor_demo.py --file /path/to/data.xlsx --model llama3.2 --question "지난주 일평균 대비 어제 매출은?"
+#   (--question 여러 개 → 동시 요청. 서버를 OLLAMA_NUM_PARALLEL=<질문 수> 로 띄워야 병렬 처리됩니다.)
+#   (--cache ollama_cache.npz: 비슷한 질문은 의미 캐시에서 JSON을 바로 꺼냄. 기본은 꺼짐, ollama pull nomic-embed-text 필요)
 import argparse
+import asyncio
 import json
+import re
 import sys
-import subprocess
+from datetime import datetime
+import httpx
+import numpy as np
 import pandas as pd
+from importlib.util import find_spec
+try:
+    import polars as pl  # 있으면 CSV/Excel 읽기를 polars로 (pandas 대비 수 배 빠름)
+except ImportError:
+    pl = None
+POLARS_EXCEL = pl is not None and find_spec('fastexcel') is not None  # read_excel(calamine) 엔진
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 from zoneinfo import ZoneInfo
+try:
+    import orjson  # 있으면 JSON 인코딩/디코딩을 orjson으로 (Rust 구현, 수 배 빠름)
+    _loads = orjson.loads
+    def _dumps(o):
+        return orjson.dumps(o, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+except ImportError:
+    _loads = json.loads
+    def _dumps(o):
+        # orjson과 같은 출력(한글 그대로, 공백 없음)
+        return json.dumps(o, ensure_ascii=False, separators=(',', ':'))
+from cache import SemanticCache, namespace
+
+OLLAMA_HOST = 'http://localhost:11434'
+client = httpx.AsyncClient(base_url=OLLAMA_HOST, timeout=None)
 
 def pick_column(cols, candidates):
     lower = {c.lower(): c for c in cols}
@@ -21,16 +51,59 @@ def pick_column(cols, candidates):
             return lower[cand]
     return cols[0]
 
+# 날짜 형식 후보. '/' 구분은 pandas 기본 추론과 같게 월/일 우선
+DATE_FORMATS = ['%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y/%m/%d', '%m/%d/%Y', '%d/%m/%Y']
+
+def detect_date_format(sample):
+    for fmt in DATE_FORMATS:
+        try:
+            datetime.strptime(sample, fmt)
+            return fmt
+        except ValueError:
+            pass
+    return None
+
+def first_str(values):
+    # 첫 번째 non-null 값이 문자열이면 반환 (이미 날짜 타입이면 None)
+    for v in values:
+        if pd.notna(v):
+            return v if isinstance(v, str) else None
+    return None
+
 def load_table(path):
-    if path.lower().endswith(('.xlsx', '.xls')):
-        df = pd.read_excel(path)
+    is_excel = path.lower().endswith(('.xlsx', '.xls'))
+    use_pl = POLARS_EXCEL if is_excel else pl is not None
+    if use_pl:
+        # 스키마만 보고 컬럼을 고른 뒤 두 컬럼만 읽음. pandas 변환은 마지막에 한 번만
+        # infer_schema_length=None: 앞 100행만 보고 타입을 정하면 뒤쪽 값(예: 정수 뒤 12.5)에서 실패
+        if is_excel:
+            lf = pl.read_excel(path, infer_schema_length=None).lazy()
+        else:
+            lf = pl.scan_csv(path, infer_schema_length=None)
+        cols = lf.collect_schema().names()
+    else:
+        df = pd.read_excel(path) if is_excel else pd.read_csv(path)
+        cols = list(df.columns)
+    date_col = pick_column(cols, ['date','날짜','일자','order_date','created_at'])
+    amount_col = pick_column(cols, ['amount','매출','매출액','sales','sales_amount','revenue'])
+    if use_pl:
+        # 별칭으로 선택: 두 후보가 모두 cols[0]로 떨어져 같은 컬럼이어도 중복 선택 오류 없음
+        pdf = lf.select([pl.col(date_col).alias('date'), pl.col(amount_col).alias('amount')]).collect()
+        sample = first_str(pdf['date'].drop_nulls().head(1)) if pdf['date'].dtype == pl.String else None
+        fmt = detect_date_format(sample) if sample is not None else None
+        if fmt:
+            pdf = pdf.with_columns(pl.col('date').str.to_datetime(format=fmt, strict=False))
+        df = pdf.to_pandas()
     else:
-        df = pd.read_csv(path)
-    date_col = pick_column(df.columns, ['date','날짜','일자','order_date','created_at'])
-    amount_col = pick_column(df.columns, ['amount','매출','매출액','sales','sales_amount','revenue'])
-    df = df[[date_col, amount_col]].copy()
+        df = df[[date_col, amount_col]].copy()
     df.columns = ['date','amount']
-    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    # 첫 값으로 형식을 정하면 값마다 형식을 추론하지 않는 빠른 파서를 탐. 실패 시에만 추론 경로
+    sample = first_str(df['date'].head(1000))
+    fmt = detect_date_format(sample) if sample is not None else None
+    if fmt:
+        df['date'] = pd.to_datetime(df['date'], format=fmt, errors='coerce', cache=True)
+    else:
+        df['date'] = pd.to_datetime(df['date'], errors='coerce')
     df = df.dropna(subset=['date'])
     return df
 
@@ -43,7 +116,22 @@ JSON_SCHEMA_DESC = '''{
   }
 }'''
 
-PROMPT_TMPL = '''SYSTEM:
+# Ollama format=<JSON schema>: 디코딩 단계에서 스키마에 맞는 토큰만 허용 → 항상 유효한 JSON
+JSON_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'intent': {'type': 'string', 'enum': ['aggregate', 'compare', 'topN', 'trend', 'breakdown']},
+        'metric': {'type': 'string'},
+        'time': {
+            'type': 'object',
+            'properties': {'a': {'type': 'string'}, 'b': {'type': 'string'}},
+        },
+    },
+    'required': ['intent', 'metric', 'time'],
+}
+
+# 스키마까지 채운 고정 앞부분은 import 시 한 번만 만들고, 호출마다 질문만 이어붙임
+PROMPT_PREFIX = '''SYSTEM:
 너는 판매 데이터 질문을 "파라미터 JSON"으로만 변환하는 추출기다.
 반드시 한 줄 JSON만 출력하고, 다른 텍스트는 출력하지 마라.
 
@@ -55,67 +143,112 @@ Q: "지난주 일평균 대비 어제 매출은?"
 A: {{"intent":"compare","metric":"sales_amount","time":{{"a":"yesterday","b":"last_week_avg"}}}}
 
 USER 질문:
-{question}
-'''
-
-def call_ollama_json(model, prompt):
-    proc = subprocess.run(['ollama','run',model], input=prompt.encode('utf-8'),
-                          capture_output=True, check=True)
-    text = proc.stdout.decode('utf-8', errors='ignore').strip()
-    # 코드블록 제거
-    if text.startswith('```'):
-        text = text.strip('` \n')
-        if '\n' in text:
-            text = text.split('\n',1)[1]
+'''.format(schema=JSON_SCHEMA_DESC)
+
+def build_prompt(question):
+    return PROMPT_PREFIX + question + '\n'
+
+# 자주 쓰는 질문은 정규식으로 바로 JSON을 만들어 LLM 호출 자체를 생략 (fast path)
+# 질문 전체가 정확히 이 형태일 때만 (지표/부정/추가 조건이 붙으면 모델에 맡김)
+YDAY_VS_LASTWEEK_AVG = {'intent':'compare','metric':'sales_amount','time':{'a':'yesterday','b':'last_week_avg'}}
+INTENT_RULES = [
+    (re.compile(r'지난\s*주\s*일\s*평균\s*(대비)?\s*어제\s*매출(액)?\s*(은|는)?\s*\??'), YDAY_VS_LASTWEEK_AVG),
+    (re.compile(r'어제\s*매출(액)?\s*(은|는)?\s*지난\s*주\s*일\s*평균\s*대비\s*\??'), YDAY_VS_LASTWEEK_AVG),
+]
+
+def match_intent_rules(question):
+    q = question.strip()
+    for pattern, intent in INTENT_RULES:
+        if pattern.fullmatch(q):
+            return intent
+    return None
+
+async def call_ollama_json(model, prompt):
+    # format=JSON_SCHEMA: 스키마 제약 디코딩 (코드블록 제거 등 후처리 불필요)
+    # 스트리밍으로 받되 파싱은 응답이 끝난 뒤 한 번만
+    parts = []
+    async with client.stream('POST', '/api/generate', json={
+        'model': model, 'prompt': prompt, 'stream': True, 'keep_alive': '30m', 'format': JSON_SCHEMA,
+    }) as r:
+        if r.status_code != 200:
+            await r.aread()
+            r.raise_for_status()
+        async for line in r.aiter_lines():
+            if not line:
+                continue
+            chunk = _loads(line)
+            if 'error' in chunk:
+                raise RuntimeError(chunk['error'])
+            parts.append(chunk.get('response', ''))
+    text = ''.join(parts).strip()
     try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        try:
-            s = text[text.index('{'): text.rindex('}')+1]
-            return json.loads(s)
-        except Exception:
-            raise ValueError(f'모델 JSON 파싱 실패: {text}')
+        return _loads(text)
+    except ValueError:
+        raise ValueError(f'모델 JSON 파싱 실패: {text}')
+
+async def extract_intent(cache, model, question):
+    parsed = match_intent_rules(question)
+    if parsed is not None:
+        print(f'[fast path] {question}')
+        return parsed
+    # 캐시 키는 프롬프트 전체가 아니라 질문 문장 → 히트 시 모델 호출 없이 실행기로 바로 감
+    ns = namespace(model, PROMPT_PREFIX)
+    hit, emb = await cache.lookup(ns, question)
+    if hit is not None:
+        print(f'[semantic cache hit] {question}')
+        return _loads(hit)
+    prompt = build_prompt(question)
+    parsed = await call_ollama_json(model, prompt)
+    cache.add(ns, emb, _dumps(parsed))
+    return parsed
+
+# 일별 합계의 평균. days는 정수 일 번호(epoch 기준), 행이 하나라도 있는 날만 평균에 포함
+if njit is not None:
+    @njit(cache=True)
+    def daily_sum_mean(days, amounts):
+        d0 = days.min()
+        n = days.max() - d0 + 1
+        sums = np.zeros(n)
+        seen = np.zeros(n, np.bool_)
+        for i in range(days.shape[0]):
+            k = days[i] - d0
+            seen[k] = True
+            if not np.isnan(amounts[i]):
+                sums[k] += amounts[i]
+        total = 0.0
+        cnt = 0
+        for k in range(n):
+            if seen[k]:
+                total += sums[k]
+                cnt += 1
+        return total / cnt
+else:
+    def daily_sum_mean(days, amounts):
+        k = days - days.min()
+        sums = np.bincount(k, weights=np.nan_to_num(amounts))
+        return sums[np.bincount(k) > 0].mean()
 
 def compute_compare_y_vs_lastweekavg(df):
     tz = ZoneInfo('Europe/London')
     today = pd.Timestamp.now(tz).normalize()
     yday = (today - pd.Timedelta(days=1)).date()
 
-    a_df = df[df['date'].dt.date == yday]
-    a = a_df['amount'].sum() if not a_df.empty else None
+    # 날짜 비교는 일 단위 정수 배열로 (datetime.date 객체 키 groupby 회피)
+    day = df['date'].to_numpy().astype('datetime64[D]')
+    amount = df['amount'].to_numpy(np.float64)
+
+    a_mask = day == np.datetime64(yday)
+    a = df['amount'][a_mask].sum() if a_mask.any() else None
 
     y_ts = pd.Timestamp(yday, tz=tz)
     last_week_end = (y_ts - pd.Timedelta(days=(y_ts.weekday()+1)%7)).normalize()
     last_week_start = last_week_end - pd.Timedelta(days=6)
-    lw = df[(df['date']>=last_week_start) & (df['date']<=last_week_end)]
-    b = lw.groupby(lw['date'].dt.date)['amount'].sum().mean() if not lw.empty else None
+    lw_mask = (day >= np.datetime64(last_week_start.date())) & (day <= np.datetime64(last_week_end.date()))
+    b = daily_sum_mean(day[lw_mask].astype(np.int64), amount[lw_mask]) if lw_mask.any() else None
 
     return a, b, (last_week_start.date(), last_week_end.date())
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument('--file', required=True)
-    ap.add_argument('--model', default='llama3.2')
-    ap.add_argument('--question', required=True)
-    args = ap.parse_args()
-
-    df = load_table(args.file)
-    if df.empty:
-        print('데이터가 비어있거나 날짜 파싱 실패')
-        sys.exit(1)
-
-    prompt = PROMPT_TMPL.format(schema=JSON_SCHEMA_DESC, question=args.question)
-    try:
-        parsed = call_ollama_json(args.model, prompt)
-    except subprocess.CalledProcessError as e:
-        print('Ollama 호출 오류:', e.stderr.decode('utf-8', errors='ignore'))
-        sys.exit(2)
-    except Exception as e:
-        print(str(e)); sys.exit(3)
-
-    print('=== LLM JSON ===')
-    print(json.dumps(parsed, ensure_ascii=False))
-
+def execute(df, parsed):
     # 데모: compare(yesterday, last_week_avg)만 지원
     if parsed.get('intent') == 'compare' and parsed.get('metric') in ['sales','sales_amount']:
         t = parsed.get('time', {})
@@ -123,7 +256,7 @@ def main():
             a, b, (s,e) = compute_compare_y_vs_lastweekavg(df)
             if a is None or b is None or pd.isna(b):
                 print('데이터 부족으로 계산 불가')
-                sys.exit(0)
+                return
             diff = a - b
             pct = (diff / b)*100 if b != 0 else None
             sign = '증가' if diff>0 else '감소' if diff<0 else '변동 없음'
@@ -132,9 +265,45 @@ def main():
             print(f'지난주({s}~{e}) 일평균: {b:,.0f}원')
             print(f'차이: {abs(diff):,.0f}원 {sign}' + (f' ({pct:.1f}%)' if pct is not None else ''))
             print('\n[근거] 정의: 어제=현재(Europe/London) 기준 D-1, 지난주=직전 월~일, 일별 합계의 평균')
-            sys.exit(0)
+            return
 
     print('아직 이 JSON 조합은 데모 실행기에 없어요. (intent/시간 프리셋 추가 필요)')
 
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--file', required=True)
+    ap.add_argument('--model', default='llama3.2')
+    ap.add_argument('--question', required=True, nargs='+')
+    ap.add_argument('--cache', default='', help='semantic cache file, e.g. ollama_cache.npz (default: off)')
+    args = ap.parse_args()
+
+    df = load_table(args.file)
+    if df.empty:
+        print('데이터가 비어있거나 날짜 파싱 실패')
+        sys.exit(1)
+
+    cache = SemanticCache(client, args.cache)
+    async with client:
+        results = await asyncio.gather(*(extract_intent(cache, args.model, q) for q in args.question),
+                                       return_exceptions=True)
+    cache.save()
+
+    rc = 0
+    for q, parsed in zip(args.question, results):
+        print(f'=== 질문: {q} ===')
+        if isinstance(parsed, (httpx.HTTPError, RuntimeError)):
+            print('Ollama 호출 오류:', parsed)
+            rc = rc or 2
+            continue
+        if isinstance(parsed, Exception):
+            print(str(parsed))
+            rc = rc or 3
+            continue
+
+        print('=== LLM JSON ===')
+        print(_dumps(parsed))
+        execute(df, parsed)
+    sys.exit(rc)
+
 if __name__ == '__main__':
-    main()
+    asyncio.run(main())
@@ -5,81 +5,249 @@
 # Features:
 # - Interactive chat loop with your Ollama model (default: llama3.2)
 # - Optional system prompt (--system)
-# - Attach one or more files as context (--file path ...); content is pasted into the first turn
+# - Attach one or more files as context (--file path ...); content is sent as the first user message
+#   and kept across /reset; --max-context-bytes caps each file
 # - Temperature control (--temp), context tokens (--ctx)
 # - JSON mode (--json) to encourage structured output
 # - Save transcript to a markdown file (--save chat.md)
-# - Commands: /sys, /reset, /save <file>, /model <name>, /exit
+# - Exact-match reply cache (--exact-cache, default ~/.ollama_playground.cache): an identical prompt
+#   with the same model/temperature/ctx skips the model entirely ('' to disable)
+# - Opt-in semantic reply cache (--cache file.npz): a paraphrased message at the same point in the
+#   conversation reuses the stored reply (needs: ollama pull nomic-embed-text)
+# - Commands: /sys, /reset, /save <file>, /model <name>, /parallel <n>, /exit
+#   /parallel <n> reads n lines and sends them concurrently (start the server with OLLAMA_NUM_PARALLEL>=n)
 #
-# Note: This calls "ollama run <model>" each turn and resends local history.
+# Note: This talks to the local Ollama server over HTTP (/api/chat) and resends local history.
+#       Messages are always sent as system, context files, then turns, and earlier entries are
+#       never edited, so each request extends the previous one byte-for-byte and Ollama can reuse
+#       the KV cache for that prefix. --keep-alive keeps the model (and that cache) resident;
+#       the default -1 pins it until the server stops.
+#       Each concurrent playground session needs its own server slot, so run several at once
+#       with OLLAMA_NUM_PARALLEL >= number of sessions (otherwise they queue and evict each other's cache).
 import argparse
+import asyncio
+import atexit
+import hashlib
+import json
+import mmap
 import os
-import subprocess
+import shelve
+import sys
 import textwrap
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-def read_files(paths):
-    chunks = []
-    for p in paths or []:
-        try:
-            with open(p, "r", encoding="utf-8", errors="ignore") as f:
-                content = f.read()
-            chunks.append(f"\n=== FILE: {os.path.basename(p)} ===\n{content}\n")
-        except Exception as e:
-            chunks.append(f"\n=== FILE: {os.path.basename(p)} (READ ERROR) ===\n{e}\n")
+import httpx
+
+from cache import SemanticCache, namespace
+
+try:
+    from orjson import loads as _loads  # faster per-line decoding of the streamed NDJSON
+except ImportError:
+    _loads = json.loads
+
+OLLAMA_HOST = "http://localhost:11434"
+client = httpx.AsyncClient(base_url=OLLAMA_HOST, timeout=None)
+EXACT_CACHE_PATH = "~/.ollama_playground.cache"
+SYNC_EVERY = 10  # turns between exact-cache fsyncs
+JSON_HINT = "(Respond ONLY with valid JSON. No extra text.)"
+KEEP_ALIVE = -1  # seconds; negative = keep the model loaded indefinitely
+MMAP_MIN_BYTES = 1 << 16  # below this a plain read is cheaper than setting up a mapping
+
+def keep_alive_arg(value):
+    # Ollama takes a duration string ("30m") or a number of seconds; "-1" as a string is rejected
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+def positive_int(value):
+    # --max-context-bytes: 0 or a negative cap would silently mean "no cap" or "drop the tail"
+    n = int(value)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return n
+
+def read_file(path, max_bytes=None):
+    # Read raw bytes (no TextIOWrapper line handling), cap before decoding, decode once
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < MMAP_MIN_BYTES:
+            data = f.read(max_bytes or -1)
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                data = mm[:max_bytes] if max_bytes else mm[:]
+    return data.decode("utf-8", errors="ignore")
+
+def read_file_block(path, max_bytes=None):
+    try:
+        content = read_file(path, max_bytes)
+        return f"\n=== FILE: {os.path.basename(path)} ===\n{content}\n"
+    except Exception as e:
+        return f"\n=== FILE: {os.path.basename(path)} (READ ERROR) ===\n{e}\n"
+
+def read_files(paths, max_bytes=None):
+    if not paths:
+        return ""
+    # Reads overlap in the kernel (reads release the GIL); map() keeps the original file order
+    with ThreadPoolExecutor(max_workers=min(8, len(paths))) as ex:
+        chunks = list(ex.map(lambda p: read_file_block(p, max_bytes), paths))
     return "\n".join(chunks)
 
-def build_prompt(system_msg, history, json_mode=False):
-    sys_block = f"SYSTEM:\n{system_msg}\n\n" if system_msg else ""
-    conv = []
-    for role, content in history:
-        conv.append(f"{role.upper()}:\n{content}\n")
-    prompt = sys_block + "\n".join(conv)
-    if json_mode:
-        prompt += "\n(Respond ONLY with valid JSON. No extra text.)\n"
-    return prompt
+def build_messages(system_msg, context, json_mode=False):
+    # The JSON hint lives in the system message (not after the last turn) so the prefix stays stable
+    sys_text = "\n\n".join(s for s in (system_msg, JSON_HINT if json_mode else "") if s)
+    messages = []
+    if sys_text:
+        messages.append({"role": "system", "content": sys_text})
+    if context:
+        messages.append({"role": "user", "content": context})
+    return messages
+
+# Running message list plus a running SHA-256 over it.
+# Turns are only ever appended, so a turn costs O(turn) rather than
+# re-formatting and re-hashing the whole history.
+class Conversation:
+    def __init__(self, system_msg, context, json_mode=False):
+        self.context = context
+        self.json_mode = json_mode
+        self.reset(system_msg)
+
+    def reset(self, system_msg, turns=()):
+        base = build_messages(system_msg, self.context, json_mode=self.json_mode)
+        self.base_len = len(base)
+        self.messages = []
+        self._hash = hashlib.sha256()
+        for m in base + list(turns):
+            self._append(m)
+
+    def set_system(self, system_msg):
+        # Rewrites the prefix once; turns are kept
+        self.reset(system_msg, turns=self.messages[self.base_len:])
+
+    def _append(self, m):
+        self.messages.append(m)
+        self._hash.update(json.dumps(m, ensure_ascii=False).encode("utf-8") + b"\n")
 
-def run_ollama(model, prompt, ctx_tokens=None, temperature=0.7):
-    cmd = ["ollama", "run", model]
-    env = os.environ.copy()
+    def append(self, role, content):
+        self._append({"role": role, "content": content})
+
+    def digest(self):
+        return self._hash.hexdigest()
+
+def write_chunk(piece):
+    sys.stdout.write(piece)
+    sys.stdout.flush()
+
+async def run_ollama(model, messages, ctx_tokens=None, temperature=0.7, json_mode=False, keep_alive=KEEP_ALIVE,
+                     on_chunk=None):
+    # Always streamed; on_chunk (if given) sees each piece as it arrives, the full reply is returned
+    options = {"temperature": temperature}
     if ctx_tokens:
-        env["OLLAMA_NUM_CTX"] = str(ctx_tokens)
-    env["OLLAMA_TEMPERATURE"] = str(temperature)
-    proc = subprocess.run(cmd, input=prompt.encode("utf-8"), capture_output=True, env=env)
-    if proc.returncode != 0:
-        raise RuntimeError(proc.stderr.decode("utf-8", errors="ignore"))
-    return proc.stdout.decode("utf-8", errors="ignore").strip()
-
-def main():
+        options["num_ctx"] = ctx_tokens
+    payload = {"model": model, "messages": messages, "stream": True, "keep_alive": keep_alive, "options": options}
+    if json_mode:
+        payload["format"] = "json"
+    parts = []
+    async with client.stream("POST", "/api/chat", json=payload) as r:
+        if r.status_code != 200:
+            raise RuntimeError((await r.aread()).decode("utf-8", errors="ignore"))
+        async for line in r.aiter_lines():
+            if not line:
+                continue
+            chunk = _loads(line)
+            if "error" in chunk:
+                raise RuntimeError(chunk["error"])
+            piece = chunk.get("message", {}).get("content", "")
+            parts.append(piece)
+            if on_chunk is not None:
+                on_chunk(piece)
+    return "".join(parts).strip()
+
+async def cached_reply(exact, cache, model, conv, user,
+                       ctx_tokens=None, temperature=0.7, json_mode=False, keep_alive=KEEP_ALIVE, on_chunk=None):
+    prefix = conv.digest()
+    messages = conv.messages + [{"role": "user", "content": user}]
+    key = hashlib.sha256(f"{model}\0{temperature}\0{ctx_tokens}\0{prefix}\0{user}".encode("utf-8")).hexdigest()
+    if exact is not None and key in exact:
+        print("[cache hit]")
+        reply = exact[key]
+        if on_chunk is not None:
+            on_chunk(reply)
+        return reply
+    # Only the new message is embedded; everything before it must match exactly (namespace hash)
+    ns = namespace(model, prefix)
+    reply, emb = await cache.lookup(ns, user)
+    if reply is not None:
+        print("[semantic cache hit]")
+        if on_chunk is not None:
+            on_chunk(reply)
+    else:
+        reply = await run_ollama(model, messages, ctx_tokens=ctx_tokens, temperature=temperature,
+                                 json_mode=json_mode, keep_alive=keep_alive, on_chunk=on_chunk)
+        cache.add(ns, emb, reply)
+    if exact is not None:
+        exact[key] = reply
+    return reply
+
+def autosave(fp, user, reply):
+    # Append only this turn; flush (no fsync) so the file is current without rewriting it
+    try:
+        fp.write(f"**You:** {user}\n**Assistant:**\n{reply}\n\n")
+        fp.flush()
+    except Exception as e:
+        print(f"[autosave error] {e}")
+
+async def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--model", default="llama3.2", help="Ollama model name")
     ap.add_argument("--system", default="", help="System prompt text")
     ap.add_argument("--file", nargs="*", help="Context files (text/markdown/code). Included in first turn.")
+    ap.add_argument("--max-context-bytes", type=positive_int, default=None, help="Truncate each context file to this many bytes")
     ap.add_argument("--temp", type=float, default=0.7, help="Sampling temperature")
-    ap.add_argument("--ctx", type=int, default=None, help="Context window tokens (OLLAMA_NUM_CTX)")
+    ap.add_argument("--ctx", type=int, default=None, help="Context window tokens (num_ctx)")
     ap.add_argument("--json", action="store_true", help="Ask model to respond only with JSON")
     ap.add_argument("--save", default="", help="Save transcript to this markdown file")
+    ap.add_argument("--cache", default="", help="Semantic reply cache file, e.g. ollama_cache.npz (default: off)")
+    ap.add_argument("--exact-cache", default=EXACT_CACHE_PATH, help="Exact-match reply cache file ('' to disable)")
+    ap.add_argument("--keep-alive", type=keep_alive_arg, default=KEEP_ALIVE,
+                    help="How long the server keeps the model loaded: duration (30m) or seconds; -1 = forever")
     args = ap.parse_args()
 
-    history = []  # list of (role, content)
     system_msg = args.system.strip()
 
-    # If files attached, send them as the first "context" from USER
+    # If files attached, send them as the first "context" from USER (fixed, survives /reset)
+    context = ""
     if args.file:
-        files_block = read_files(args.file)
+        files_block = read_files(args.file, args.max_context_bytes)
         if files_block:
-            history.append(("user", f"CONTEXT FILES BELOW. The assistant should use them when relevant.\n{files_block}"))
+            context = f"CONTEXT FILES BELOW. The assistant should use them when relevant.\n{files_block}"
 
     print(f"[Ollama Playground] Model={args.model} | temp={args.temp} | ctx={args.ctx or 'default'} | JSON={args.json}")
     if system_msg:
         print(f"[system] {system_msg}\n")
-    print("Type your message. Commands: /sys, /reset, /save, /model, /exit")
+    print("Type your message. Commands: /sys, /reset, /save, /model, /parallel, /exit")
 
-    transcript = []
+    transcript = []  # kept for on-demand /save
     if system_msg:
         transcript.append(f"### SYSTEM\n{system_msg}\n")
 
+    # --save: one handle for the whole session, each turn appended
+    save_fp = None
+    if args.save:
+        try:
+            save_fp = open(args.save, "w", encoding="utf-8", buffering=1 << 16)
+            atexit.register(save_fp.close)
+            if transcript:
+                save_fp.write(transcript[0] + "\n")
+        except Exception as e:
+            print(f"[autosave error] {e}")
+
     model = args.model
+    conv = Conversation(system_msg, context, json_mode=args.json)
+    cache = SemanticCache(client, args.cache)
+    exact = shelve.open(os.path.expanduser(args.exact_cache)) if args.exact_cache else None
+    turns = 0
 
     while True:
         try:
@@ -100,15 +268,24 @@ def main():
                 print("Bye.")
                 break
             elif cmd == "/reset":
-                history = []
+                conv.reset(system_msg)
                 print("[reset] conversation cleared.")
                 continue
             elif cmd == "/sys":
                 system_msg = arg
+                conv.set_system(system_msg)
                 print("[system updated]")
                 continue
             elif cmd == "/save":
                 path = arg or (args.save or f"ollama_chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}.md")
+                if save_fp and os.path.abspath(path) == os.path.abspath(args.save):
+                    # Already being appended to: rewriting it under the open handle would corrupt it
+                    try:
+                        save_fp.flush()
+                        print(f"[saved] {path}")
+                    except Exception as e:
+                        print(f"[save error] {e}")
+                    continue
                 transcript_text = "\n".join(transcript)
                 try:
                     with open(path, "w", encoding="utf-8") as f:
@@ -121,34 +298,75 @@ def main():
                 model = arg or model
                 print(f"[model set] {model}")
                 continue
+            elif cmd == "/parallel":
+                try:
+                    n = int(arg)
+                except ValueError:
+                    print("Usage: /parallel <n>")
+                    continue
+                lines = []
+                for i in range(n):
+                    try:
+                        line = input(f"[{i + 1}/{n}]> ").strip()
+                    except (EOFError, KeyboardInterrupt):
+                        break
+                    if line:
+                        lines.append(line)
+                # Each line is answered against the same conversation snapshot, then appended in order
+                replies = await asyncio.gather(
+                    *(cached_reply(exact, cache, model, conv, line,
+                                   ctx_tokens=args.ctx, temperature=args.temp, json_mode=args.json,
+                                   keep_alive=args.keep_alive) for line in lines),
+                    return_exceptions=True,
+                )
+                for line, reply in zip(lines, replies):
+                    if isinstance(reply, Exception):
+                        print(f"[ollama error] {line}\n{reply}")
+                        continue
+                    conv.append("user", line)
+                    conv.append("assistant", reply)
+                    print(f"\nYou> {line}\nAssistant> {reply}\n")
+                    transcript.append(f"**You:** {line}")
+                    transcript.append(f"**Assistant:**\n{reply}\n")
+                    if save_fp:
+                        autosave(save_fp, line, reply)
+                    turns += 1
+                    if exact is not None and turns % SYNC_EVERY == 0:
+                        exact.sync()
+                continue
             else:
-                print("Unknown command. Use /sys, /reset, /save <file>, /model <name>, /exit")
+                print("Unknown command. Use /sys, /reset, /save <file>, /model <name>, /parallel <n>, /exit")
                 continue
 
         # Normal user turn
-        history.append(("user", user))
-        prompt = build_prompt(system_msg, history, json_mode=args.json)
+        print("\nAssistant> ", end="", flush=True)
         try:
-            reply = run_ollama(model, prompt, ctx_tokens=args.ctx, temperature=args.temp)
+            reply = await cached_reply(exact, cache, model, conv, user,
+                                       ctx_tokens=args.ctx, temperature=args.temp, json_mode=args.json,
+                                       keep_alive=args.keep_alive, on_chunk=write_chunk)
         except Exception as e:
-            print(f"[ollama error]\n{e}")
-            history.pop()  # revert last user message on error
+            print(f"\n[ollama error]\n{e}")
             continue
+        print("\n")
 
-        history.append(("assistant", reply))
-        print(f"\nAssistant> {reply}\n")
+        conv.append("user", user)
+        conv.append("assistant", reply)
+        turns += 1
+        if exact is not None and turns % SYNC_EVERY == 0:
+            exact.sync()
 
         # Append to transcript
         transcript.append(f"**You:** {user}")
         transcript.append(f"**Assistant:**\n{reply}\n")
 
         # Autosave if --save provided
-        if args.save:
-            try:
-                with open(args.save, "w", encoding="utf-8") as f:
-                    f.write("\n".join(transcript))
-            except Exception as e:
-                print(f"[autosave error] {e}")
+        if save_fp:
+            autosave(save_fp, user, reply)
+
+    if exact is not None:
+        exact.close()
+    cache.save()
+    await client.aclose()
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())